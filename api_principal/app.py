@@ -1,16 +1,46 @@
+import atexit
+import hashlib
 import os
+import queue
+import re
 import sqlite3
-from datetime import datetime
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from typing import Tuple
+from urllib.parse import urlparse
 
-from flask import Flask, jsonify, request, g
+from flask import Flask, g, has_app_context, jsonify, request, send_file
+from flask.json.provider import JSONProvider
 from flasgger import Swagger
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ---------------------------------------------
 # Configurações básicas
 # ---------------------------------------------
+class OrjsonProvider(JSONProvider):
+    """Provider JSON do Flask baseado em orjson (serialização mais rápida que o json da stdlib)."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Serializa direto para bytes, sem passar por str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), mimetype="application/json"
+        )
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 swagger_template = {
     "swagger": "2.0",
@@ -23,32 +53,222 @@ swagger_template = {
 }
 Swagger(app, template=swagger_template)
 
+# Spec OpenAPI pré-gerada no build (gerar_apispec.py): servida como arquivo estático,
+# sem o Flasgger percorrer as rotas a cada /apispec_1.json. Sem o arquivo (dev), o Flasgger gera.
+APISPEC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "apispec.json")
+if os.path.exists(APISPEC_PATH):
+    app.view_functions["flasgger.apispec_1"] = lambda: send_file(APISPEC_PATH, mimetype="application/json")
+
 # URL da API Secundária (pode ser alterada por variável de ambiente)
-API_SECUNDARIA_URL = os.getenv("API_SECUNDARIA_URL", "http://127.0.0.1:5001")
+API_SECUNDARIA_URL = os.getenv("API_SECUNDARIA_URL") or "http://127.0.0.1:5001"
+
+# Haversine em processo: com a API Secundária no mesmo host (repositório completo,
+# execução local), importa a função diretamente e evita o round-trip HTTP.
+_DIR_SECUNDARIA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api_secundaria")
+if os.path.isdir(_DIR_SECUNDARIA) and _DIR_SECUNDARIA not in sys.path:
+    sys.path.append(_DIR_SECUNDARIA)
+try:
+    from distancia import haversine_km
+except ImportError:
+    haversine_km = None
+HAVERSINE_LOCAL = haversine_km is not None and urlparse(API_SECUNDARIA_URL).hostname in ("127.0.0.1", "localhost", "::1")
 # Caminho do banco SQLite
 DB_PATH = os.getenv("DB_PATH", os.path.join(os.path.dirname(__file__), "mvp2.db"))
+# Janela (em horas) para reaproveitar um par de CEPs já calculado (0 desativa)
+REUSO_PAR_HORAS = int(os.getenv("REUSO_PAR_HORAS", "24"))
+# Validade do cache de respostas ViaCEP/Nominatim (em segundos)
+CACHE_TTL = int(os.getenv("CACHE_TTL", str(30 * 24 * 3600)))
+# Pool de conexões SQLite: tamanho e espera máxima (s) por uma conexão livre
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "16"))
+DB_POOL_TIMEOUT = 10
+# Máximo de pares por chamada ao /distancia-por-cep/bulk (cada par custa até 4 consultas externas)
+MAX_ITENS_BULK = 50
+
+# Sessão HTTP compartilhada: keep-alive + pool de conexões para ViaCEP, Nominatim e API Secundária
+SESSION = requests.Session()
+SESSION.headers["User-Agent"] = "MVP2-CEP-Distancia/1.0 (contato-exemplo@exemplo.com)"
+_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=Retry(total=2, backoff_factor=0.3))
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+# Pool de threads para disparar em paralelo as consultas externas independentes.
+# Cada request ocupa no máximo uma thread por vez (a outra consulta roda inline),
+# então o padrão acompanha o --worker-connections do gunicorn.
+EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv("CONSULTAS_PARALELAS", "200")))
 
 # ---------------------------------------------
 # Camada de persistência (SQLite)
 # ---------------------------------------------
+# Statements SQL (strings únicas reaproveitadas pelo cache de statements do sqlite3)
+SQL_INSERT = """
+    INSERT INTO consultas (cep_origem, cep_destino, lat1, lon1, lat2, lon2, distancia_km, criado_em, observacoes)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_LIST = """
+    SELECT id, cep_origem, cep_destino, lat1, lon1, lat2, lon2, distancia_km, criado_em, observacoes
+    FROM consultas
+    WHERE id < ?
+    ORDER BY id DESC
+    LIMIT ?
+"""
+# Paginação legada por OFFSET (deprecada: custo O(offset) por página)
+SQL_LIST_OFFSET = """
+    SELECT id, cep_origem, cep_destino, lat1, lon1, lat2, lon2, distancia_km, criado_em, observacoes
+    FROM consultas
+    ORDER BY id DESC
+    LIMIT ? OFFSET ?
+"""
+# Colunas de SQL_LIST/SQL_LIST_OFFSET, na ordem do SELECT
+COLUNAS_CONSULTA = ("id", "cep_origem", "cep_destino", "lat1", "lon1", "lat2", "lon2",
+                    "distancia_km", "criado_em", "observacoes")
+# Maior rowid possível no SQLite (primeira página do keyset)
+SQLITE_MAX_ID = 2**63 - 1
+SQL_GET = "SELECT * FROM consultas WHERE id = ?"
+# RETURNING (SQLite >= 3.35): escreve e devolve a linha num único statement
+SQL_UPDATE = "UPDATE consultas SET observacoes = ? WHERE id = ? RETURNING *"
+SQL_DELETE = "DELETE FROM consultas WHERE id = ? RETURNING id"
+SQL_PAR_RECENTE = """
+    SELECT lat1, lon1, lat2, lon2, distancia_km
+    FROM consultas
+    WHERE cep_origem = ? AND cep_destino = ? AND criado_em >= ?
+    ORDER BY criado_em DESC
+    LIMIT 1
+"""
+SQL_VERSAO = "SELECT versao FROM consultas_versao WHERE id = 1"
+SQL_CACHE_GET = "SELECT v FROM cache WHERE k = ? AND ts >= ?"
+SQL_CACHE_SET = "INSERT OR REPLACE INTO cache (k, v, ts) VALUES (?, ?, ?)"
+SQL_CACHE_PURGE = "DELETE FROM cache WHERE ts < ?"
+
+def abrir_conexao() -> sqlite3.Connection:
+    """Abre uma conexão SQLite já configurada (autocommit + PRAGMAs por conexão)."""
+    # isolation_level=None: transações explícitas via transacao()
+    db = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    db.row_factory = sqlite3.Row
+    # PRAGMAs por conexão (não persistem no arquivo)
+    db.execute("PRAGMA busy_timeout=5000")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("PRAGMA temp_store=MEMORY")
+    db.execute("PRAGMA cache_size=-20000")
+    return db
+
+# Pool limitado de conexões pré-abertas (criado após o init_db()); LIFO reaproveita as mais "quentes"
+_pool: queue.LifoQueue = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
 def get_db() -> sqlite3.Connection:
-    """Obtém conexão SQLite por request (thread-safe no contexto Flask)."""
+    """Obtém uma conexão do pool, reservada para o request atual (devolvida no teardown)."""
     if "db" not in g:
-        g.db = sqlite3.connect(DB_PATH)
-        g.db.row_factory = sqlite3.Row
+        g.db = _pool.get(timeout=DB_POOL_TIMEOUT)
     return g.db
 
+@contextmanager
+def conexao():
+    """
+    Conexão para uso pontual: a do request atual, se já reservada; senão uma
+    emprestada do pool só durante o bloco (threads auxiliares, fora do app context).
+    """
+    if has_app_context() and "db" in g:
+        yield g.db
+        return
+    db = _pool.get(timeout=DB_POOL_TIMEOUT)
+    try:
+        yield db
+    finally:
+        _pool.put(db)
+
+def devolver_conexao(db: sqlite3.Connection) -> None:
+    """Devolve a conexão ao pool, desfazendo qualquer transação pendente."""
+    if db.in_transaction:
+        db.execute("ROLLBACK")
+    _pool.put(db)
+
 @app.teardown_appcontext
-def close_db(exception):
-    """Fecha conexão ao final do request."""
+def devolver_db(exception):
+    """Devolve ao pool a conexão reservada pelo request."""
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        devolver_conexao(db)
+
+@contextmanager
+def transacao(db: sqlite3.Connection, modo: str = "IMMEDIATE"):
+    """
+    Executa o bloco dentro de BEGIN/COMMIT, com ROLLBACK em caso de erro.
+    IMMEDIATE reserva a escrita já no BEGIN: com várias conexões, um BEGIN
+    DEFERRED que depois escreve pode falhar com "database is locked" sem
+    respeitar o busy_timeout.
+    """
+    db.execute(f"BEGIN {modo}".strip())
+    try:
+        yield db
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+@atexit.register
+def close_db():
+    """Fecha as conexões do pool ao encerrar o processo."""
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+def migrar_criado_em(conn: sqlite3.Connection):
+    """Converte bancos antigos com criado_em TEXT (ISO 8601) para INTEGER (µs desde epoch, UTC)."""
+    # IMMEDIATE + leitura do tipo dentro da transação: os workers do gunicorn rodam
+    # init_db() ao mesmo tempo, e só o primeiro a obter o lock pode migrar
+    conn.execute("BEGIN IMMEDIATE")
+    tipo = next(col[2] for col in conn.execute("PRAGMA table_info(consultas)") if col[1] == "criado_em")
+    if tipo.upper() == "INTEGER":
+        conn.execute("ROLLBACK")
+        return
+    # Não dá para alterar o tipo de uma coluna no SQLite: recria a tabela e copia os dados
+    conn.execute(
+        """
+        CREATE TABLE consultas_nova (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cep_origem TEXT NOT NULL,
+            cep_destino TEXT NOT NULL,
+            lat1 REAL NOT NULL,
+            lon1 REAL NOT NULL,
+            lat2 REAL NOT NULL,
+            lon2 REAL NOT NULL,
+            distancia_km REAL NOT NULL,
+            criado_em INTEGER NOT NULL,
+            observacoes TEXT
+        );
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO consultas_nova
+        SELECT id, cep_origem, cep_destino, lat1, lon1, lat2, lon2, distancia_km,
+               CAST(strftime('%s', criado_em) AS INTEGER) * 1000000, observacoes
+        FROM consultas
+        """
+    )
+    # Preserva o contador do AUTOINCREMENT: ids de consultas já excluídas não podem ser reutilizados
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'consultas_nova'")
+    conn.execute(
+        """
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT 'consultas_nova', seq FROM sqlite_sequence WHERE name = 'consultas'
+        """
+    )
+    conn.execute("DROP TABLE consultas")
+    conn.execute("ALTER TABLE consultas_nova RENAME TO consultas")
+    conn.execute("COMMIT")
 
 def init_db():
-    """Cria a tabela se não existir."""
-    conn = sqlite3.connect(DB_PATH)
+    """Cria a tabela se não existir e configura o journal (WAL)."""
+    # timeout alto: outro worker pode estar migrando um banco grande ao mesmo tempo
+    conn = sqlite3.connect(DB_PATH, timeout=60)
     try:
+        # auto_vacuum precisa vir antes do journal_mode: a troca para WAL já inicializa o arquivo
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL + synchronous=NORMAL: evita fsync a cada INSERT no caminho de escrita
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS consultas (
@@ -60,31 +280,116 @@ def init_db():
                 lat2 REAL NOT NULL,
                 lon2 REAL NOT NULL,
                 distancia_km REAL NOT NULL,
-                criado_em TEXT NOT NULL,
+                criado_em INTEGER NOT NULL,
                 observacoes TEXT
             );
             """
         )
+        migrar_criado_em(conn)
+        # Cache persistente de respostas externas (ViaCEP/Nominatim)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                k TEXT PRIMARY KEY,
+                v TEXT NOT NULL,
+                ts INTEGER NOT NULL
+            );
+            """
+        )
+        # Índices: busca por par de CEPs (reuso) e ordenação/filtro por data
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_consultas_pair ON consultas(cep_origem, cep_destino)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_consultas_criado ON consultas(criado_em DESC)")
+        # Versão da tabela consultas (incrementada por triggers a cada escrita), base do ETag da listagem
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS consultas_versao (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                versao INTEGER NOT NULL
+            );
+            """
+        )
+        conn.execute("INSERT OR IGNORE INTO consultas_versao (id, versao) VALUES (1, 0)")
+        for evento in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_consultas_versao_{evento.lower()}
+                AFTER {evento} ON consultas
+                BEGIN
+                    UPDATE consultas_versao SET versao = versao + 1 WHERE id = 1;
+                END;
+                """
+            )
+        # Entradas vencidas só deixam de ser lidas (cache_get): remove-as aqui para a tabela não crescer sem limite
+        conn.execute(SQL_CACHE_PURGE, (int(time.time()) - CACHE_TTL,))
         conn.commit()
+        # Devolve ao sistema as páginas liberadas por DELETEs (auto_vacuum=INCREMENTAL não faz isso
+        # sozinho). executescript: o pragma libera uma página por passo, e execute() só dá um passo
+        conn.executescript("PRAGMA incremental_vacuum;")
     finally:
         conn.close()
 
-# Inicializa o banco no startup
+# Inicializa o banco no startup e pré-abre o pool de conexões
 init_db()
+for _ in range(DB_POOL_SIZE):
+    _pool.put(abrir_conexao())
+
+def formatar_criado_em(criado_em: int) -> str:
+    """Formata criado_em (µs desde epoch, UTC) como ISO 8601 ('...Z'), só na hora de serializar."""
+    return datetime.fromtimestamp(criado_em // 1_000_000, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def consulta_para_dict(row) -> dict:
+    """Converte uma linha de consultas (sqlite3.Row ou pares coluna/valor) em dict serializável."""
+    dados = dict(row)
+    dados["criado_em"] = formatar_criado_em(dados["criado_em"])
+    return dados
+
+# ---------------------------------------------
+# Cache de respostas externas (tabela `cache`)
+# ---------------------------------------------
+def _chave_cache(prefixo: str, valor: str) -> str:
+    return f"{prefixo}:" + hashlib.sha1(valor.encode("utf-8")).hexdigest()
+
+def cache_get(chave: str):
+    """Retorna o valor (desserializado) da chave, ou None se ausente/expirado."""
+    with conexao() as db:
+        row = db.execute(SQL_CACHE_GET, (chave, int(time.time()) - CACHE_TTL)).fetchone()
+    if row is None:
+        return None
+    return orjson.loads(row["v"])
+
+def cache_set(chave: str, valor) -> None:
+    """Grava (ou substitui) o valor serializado da chave."""
+    with conexao() as db:
+        db.execute(SQL_CACHE_SET, (chave, orjson.dumps(valor).decode(), int(time.time())))
 
 # ---------------------------------------------
 # Utilitários externos (ViaCEP + Nominatim)
 # ---------------------------------------------
+CEP_RE = re.compile(r"^\d{8}$", re.ASCII)
+
+def validar_cep(cep: str) -> str:
+    """Normaliza o CEP (sem hífen/espaços) e valida o formato localmente. Lança ValueError se inválido."""
+    cep = cep.replace("-", "").strip()
+    if not CEP_RE.match(cep):
+        raise ValueError("CEP com formato inválido")
+    return cep
+
 def via_cep(cep: str) -> dict:
     """Consulta ViaCEP e retorna JSON do endereço. Lança ValueError se inválido."""
-    cep = cep.replace("-", "").strip()
+    cep = validar_cep(cep)
+    chave = _chave_cache("viacep", cep)
+    data = cache_get(chave)
+    if data is not None:
+        return data
+
     url = f"https://viacep.com.br/ws/{cep}/json/"
-    r = requests.get(url, timeout=10)
+    r = SESSION.get(url, timeout=10)
     if r.status_code != 200:
         raise ValueError(f"ViaCEP HTTP {r.status_code}")
-    data = r.json()
+    data = orjson.loads(r.content)
     if data.get("erro"):
         raise ValueError("CEP inválido no ViaCEP")
+    cache_set(chave, data)
     return data
 
 def endereco_para_query(endereco: dict) -> str:
@@ -101,22 +406,24 @@ def geocode_osm(query: str) -> Tuple[float, float]:
     Geocodifica um endereço via Nominatim/OSM.
     Retorna (lat, lon) ou lança ValueError se não encontrar.
     """
-    headers = {
-        "User-Agent": "MVP2-CEP-Distancia/1.0 (contato-exemplo@exemplo.com)"
-    }
-
     def _search(q: str):
         params = {"q": q, "format": "json", "limit": 1, "addressdetails": 0, "countrycodes": "br"}
-        resp = requests.get("https://nominatim.openstreetmap.org/search", params=params, headers=headers, timeout=15)
+        resp = SESSION.get("https://nominatim.openstreetmap.org/search", params=params, timeout=15)
         resp.raise_for_status()
-        items = resp.json()
+        items = orjson.loads(resp.content)
         if not items:
             return None
         return float(items[0]["lat"]), float(items[0]["lon"])
 
+    chave = _chave_cache("nominatim", query)
+    coords = cache_get(chave)
+    if coords is not None:
+        return tuple(coords)
+
     # 1ª tentativa: query completa
     coords = _search(query)
     if coords:
+        cache_set(chave, coords)
         return coords
 
     # 2ª tentativa: heurística simples (cidade/UF/país)
@@ -125,10 +432,114 @@ def geocode_osm(query: str) -> Tuple[float, float]:
         cidade_uf = ", ".join(partes[-3:])
         coords = _search(cidade_uf)
         if coords:
+            cache_set(chave, coords)
             return coords
 
     raise ValueError("Não foi possível geocodificar o endereço informado.")
 
+# ---------------------------------------------
+# Integração com a API Secundária (Haversine)
+# ---------------------------------------------
+class FalhaApiSecundaria(Exception):
+    """Resposta não-200 da API Secundária (mapeada para HTTP 502)."""
+
+    def __init__(self, status_code: int, detalhes: str):
+        super().__init__(f"Falha ao calcular distância na API Secundária: HTTP {status_code}")
+        self.detalhes = detalhes
+
+def calcular_distancia(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Calcula a distância em km (Haversine): em processo se local, senão via API Secundária."""
+    if HAVERSINE_LOCAL:
+        return haversine_km(lat1, lon1, lat2, lon2)
+
+    payload = {
+        "origem": {"lat": lat1, "lon": lon1},
+        "destino": {"lat": lat2, "lon": lon2}
+    }
+    r = SESSION.post(f"{API_SECUNDARIA_URL.rstrip('/')}/calcular-distancia", data=orjson.dumps(payload),
+                     headers={"Content-Type": "application/json"}, timeout=15)
+    if r.status_code != 200:
+        raise FalhaApiSecundaria(r.status_code, r.text)
+    resultado = orjson.loads(r.content)
+    return float(resultado.get("distancia_km"))
+
+def buscar_par_recente(cep_origem: str, cep_destino: str):
+    """Retorna coordenadas e distância de um cálculo recente do mesmo par, se houver."""
+    if REUSO_PAR_HORAS <= 0:
+        return None
+    limite = time.time_ns() // 1000 - REUSO_PAR_HORAS * 3600 * 1_000_000
+    with conexao() as db:
+        return db.execute(SQL_PAR_RECENTE, (cep_origem, cep_destino, limite)).fetchone()
+
+def resolver_par(cep_origem: str, cep_destino: str) -> dict:
+    """Executa ViaCEP + Nominatim + Haversine para um par de CEPs."""
+    # 1) Consulta ViaCEP (origem no pool, destino inline, em paralelo)
+    f_origem = EXECUTOR.submit(via_cep, cep_origem)
+    end_destino = via_cep(cep_destino)
+    end_origem = f_origem.result()
+
+    # Par já calculado recentemente: reaproveita coordenadas e distância
+    recente = buscar_par_recente(cep_origem, cep_destino)
+    if recente is not None:
+        return {
+            "endereco_origem": end_origem,
+            "endereco_destino": end_destino,
+            "origem": {"lat": recente["lat1"], "lon": recente["lon1"]},
+            "destino": {"lat": recente["lat2"], "lon": recente["lon2"]},
+            "distancia_km": recente["distancia_km"],
+        }
+
+    # 2) Geocodificação (Nominatim, em paralelo)
+    q_origem = endereco_para_query(end_origem)
+    q_destino = endereco_para_query(end_destino)
+    f_origem = EXECUTOR.submit(geocode_osm, q_origem)
+    lat2, lon2 = geocode_osm(q_destino)
+    lat1, lon1 = f_origem.result()
+
+    # 3) Chama API Secundária (Haversine)
+    distancia_km = calcular_distancia(lat1, lon1, lat2, lon2)
+
+    return {
+        "endereco_origem": end_origem,
+        "endereco_destino": end_destino,
+        "origem": {"lat": lat1, "lon": lon1},
+        "destino": {"lat": lat2, "lon": lon2},
+        "distancia_km": distancia_km,
+    }
+
+def gerar_json_consultas(cur: sqlite3.Cursor, limit: int = None):
+    """
+    Gera o JSON da listagem à medida que as linhas saem do cursor (sem fetchall),
+    mantendo uma linha por vez em memória. Com `limit`, inclui o 'next_before_id'.
+    """
+    yield b'{"items":['
+    total = 0
+    ultimo_id = None
+    for r in cur:
+        if total:
+            yield b","
+        yield orjson.dumps(consulta_para_dict(zip(COLUNAS_CONSULTA, r)))
+        total += 1
+        ultimo_id = r[0]
+    fim = {"total": total}
+    if limit is not None:
+        fim["next_before_id"] = ultimo_id if total == limit else None
+    # Fecha o array e acrescenta os metadados: '],"total":...}'
+    yield b"]," + orjson.dumps(fim)[1:]
+
+# ---------------------------------------------
+# Cache HTTP (ETag + Cache-Control)
+# ---------------------------------------------
+def responder_com_etag(etag: str, cache_control: str, gerar):
+    """Responde 304 se o cliente já tem a versão `etag`; senão monta a resposta com gerar()."""
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = app.make_response(gerar())
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = cache_control
+    return resp
+
 # ---------------------------------------------
 # Rotas
 # ---------------------------------------------
@@ -215,40 +626,24 @@ def distancia_por_cep():
 
         if not cep_origem or not cep_destino:
             return {"erro": "Informe 'origem' e 'destino' (CEPs)."}, 400
+        # Rejeita formato inválido antes de qualquer chamada de rede; segue com o CEP normalizado (só dígitos)
+        cep_origem = validar_cep(cep_origem)
+        cep_destino = validar_cep(cep_destino)
 
-        # 1) Consulta ViaCEP
-        end_origem = via_cep(cep_origem)
-        end_destino = via_cep(cep_destino)
-
-        # 2) Geocodificação (Nominatim)
-        q_origem = endereco_para_query(end_origem)
-        q_destino = endereco_para_query(end_destino)
-        lat1, lon1 = geocode_osm(q_origem)
-        lat2, lon2 = geocode_osm(q_destino)
-
-        # 3) Chama API Secundária (Haversine)
-        payload = {
-            "origem": {"lat": lat1, "lon": lon1},
-            "destino": {"lat": lat2, "lon": lon2}
-        }
-        r = requests.post(f"{API_SECUNDARIA_URL.rstrip('/')}/calcular-distancia", json=payload, timeout=15)
-        if r.status_code != 200:
-            return {"erro": f"Falha ao calcular distância na API Secundária: HTTP {r.status_code}",
-                    "detalhes": r.text}, 502
-        resultado = r.json()
-        distancia_km = float(resultado.get("distancia_km"))
+        # 1-3) ViaCEP + Nominatim + API Secundária
+        par = resolver_par(cep_origem, cep_destino)
+        lat1, lon1 = par["origem"]["lat"], par["origem"]["lon"]
+        lat2, lon2 = par["destino"]["lat"], par["destino"]["lon"]
+        distancia_km = par["distancia_km"]
 
         # 4) Persistência em SQLite
-        criado_em = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        criado_em = time.time_ns() // 1000
         db = get_db()
-        cur = db.execute(
-            """
-            INSERT INTO consultas (cep_origem, cep_destino, lat1, lon1, lat2, lon2, distancia_km, criado_em, observacoes)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (cep_origem, cep_destino, lat1, lon1, lat2, lon2, distancia_km, criado_em, observacoes)
-        )
-        db.commit()
+        with transacao(db):
+            cur = db.execute(
+                SQL_INSERT,
+                (cep_origem, cep_destino, lat1, lon1, lat2, lon2, distancia_km, criado_em, observacoes)
+            )
         novo_id = cur.lastrowid
 
         # 5) Resposta enriquecida
@@ -256,19 +651,145 @@ def distancia_por_cep():
             "id": novo_id,
             "cep_origem": cep_origem,
             "cep_destino": cep_destino,
-            "endereco_origem": end_origem,
-            "endereco_destino": end_destino,
-            "origem": {"lat": lat1, "lon": lon1},
-            "destino": {"lat": lat2, "lon": lon2},
+            "endereco_origem": par["endereco_origem"],
+            "endereco_destino": par["endereco_destino"],
+            "origem": par["origem"],
+            "destino": par["destino"],
             "distancia_km": round(distancia_km, 3),
-            "criado_em": criado_em,
+            "criado_em": formatar_criado_em(criado_em),
             "observacoes": observacoes
         }, 200
 
+    except FalhaApiSecundaria as fa:
+        return {"erro": str(fa), "detalhes": fa.detalhes}, 502
     except ValueError as ve:
         return {"erro": str(ve)}, 400
-    except requests.RequestException as re:
-        return {"erro": "Falha ao consultar serviços externos.", "detalhes": str(re)}, 502
+    except requests.RequestException as exc:
+        return {"erro": "Falha ao consultar serviços externos.", "detalhes": str(exc)}, 502
+    except Exception as e:
+        return {"erro": f"Erro inesperado: {str(e)}"}, 500
+
+@app.route("/distancia-por-cep/bulk", methods=["POST"])
+def distancia_por_cep_bulk():
+    """
+    Calcular distâncias para vários pares de CEPs e persistir todos em uma única transação
+    ---
+    tags:
+      - Distância
+    consumes:
+      - application/json
+    parameters:
+      - in: body
+        name: payload
+        required: true
+        schema:
+          type: object
+          required:
+            - items
+          properties:
+            items:
+              type: array
+              maxItems: 50
+              items:
+                type: object
+                required:
+                  - origem
+                  - destino
+                properties:
+                  origem:
+                    type: string
+                    example: "01001-000"
+                  destino:
+                    type: string
+                    example: "20040-020"
+                  observacoes:
+                    type: string
+                    example: "Lote de demonstração"
+    responses:
+      200:
+        description: Distâncias calculadas e registradas com sucesso
+        schema:
+          type: object
+          properties:
+            total:
+              type: integer
+            items:
+              type: array
+              items:
+                type: object
+      400:
+        description: Erro de validação ou CEP inválido
+      502:
+        description: Falha ao consultar serviços externos
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        itens = body.get("items")
+        if not isinstance(itens, list) or not itens:
+            return {"erro": "Informe 'items' como uma lista não vazia de pares de CEPs."}, 400
+        if len(itens) > MAX_ITENS_BULK:
+            return {"erro": f"Máximo de {MAX_ITENS_BULK} pares por chamada em 'items'."}, 400
+
+        pares = []
+        for i, item in enumerate(itens):
+            if not isinstance(item, dict):
+                return {"erro": f"items[{i}] deve ser um objeto com 'origem' e 'destino'."}, 400
+            cep_origem = str(item.get("origem", "")).strip()
+            cep_destino = str(item.get("destino", "")).strip()
+            if not cep_origem or not cep_destino:
+                return {"erro": f"items[{i}]: informe 'origem' e 'destino' (CEPs)."}, 400
+            try:
+                cep_origem = validar_cep(cep_origem)
+                cep_destino = validar_cep(cep_destino)
+            except ValueError as ve:
+                return {"erro": f"items[{i}]: {ve}"}, 400
+            pares.append((cep_origem, cep_destino, item.get("observacoes")))
+
+        # 1-3) ViaCEP + Nominatim + API Secundária para cada par
+        resultados = []
+        for i, (cep_origem, cep_destino, _) in enumerate(pares):
+            try:
+                resultados.append(resolver_par(cep_origem, cep_destino))
+            except ValueError as ve:
+                return {"erro": f"items[{i}]: {ve}"}, 400
+
+        # 4) Persistência em SQLite: um único BEGIN/COMMIT para o lote inteiro
+        criado_em = time.time_ns() // 1000
+        rows = [
+            (cep_origem, cep_destino,
+             par["origem"]["lat"], par["origem"]["lon"],
+             par["destino"]["lat"], par["destino"]["lon"],
+             par["distancia_km"], criado_em, observacoes)
+            for (cep_origem, cep_destino, observacoes), par in zip(pares, resultados)
+        ]
+        db = get_db()
+        with transacao(db):
+            db.executemany(SQL_INSERT, rows)
+            ultimo_id = db.execute("SELECT last_insert_rowid()").fetchone()[0]
+        # Com o lock de escrita mantido durante o lote, os IDs são contíguos
+        primeiro_id = ultimo_id - len(rows) + 1
+
+        # 5) Resposta enriquecida
+        dados = []
+        for offset, ((cep_origem, cep_destino, observacoes), par) in enumerate(zip(pares, resultados)):
+            dados.append({
+                "id": primeiro_id + offset,
+                "cep_origem": cep_origem,
+                "cep_destino": cep_destino,
+                "endereco_origem": par["endereco_origem"],
+                "endereco_destino": par["endereco_destino"],
+                "origem": par["origem"],
+                "destino": par["destino"],
+                "distancia_km": round(par["distancia_km"], 3),
+                "criado_em": formatar_criado_em(criado_em),
+                "observacoes": observacoes
+            })
+        return {"total": len(dados), "items": dados}, 200
+
+    except FalhaApiSecundaria as fa:
+        return {"erro": str(fa), "detalhes": fa.detalhes}, 502
+    except requests.RequestException as exc:
+        return {"erro": "Falha ao consultar serviços externos.", "detalhes": str(exc)}, 502
     except Exception as e:
         return {"erro": f"Erro inesperado: {str(e)}"}, 500
 
@@ -285,34 +806,58 @@ def listar_consultas():
         type: integer
         required: false
         description: "Quantidade de registros (padrão: 50, máx: 200)"
+      - in: query
+        name: before_id
+        type: integer
+        required: false
+        description: "Retorna apenas consultas com id menor que este (use o 'next_before_id' da página anterior)"
       - in: query
         name: offset
         type: integer
         required: false
-        description: "Deslocamento (paginador simples)"
+        description: "Deslocamento (DEPRECADO: use before_id)"
     responses:
       200:
         description: Lista de consultas
     """
     try:
         limit = int(request.args.get("limit", 50))
-        offset = int(request.args.get("offset", 0))
         limit = max(1, min(limit, 200))
-        offset = max(0, offset)
 
         db = get_db()
-        rows = db.execute(
-            """
-            SELECT id, cep_origem, cep_destino, lat1, lon1, lat2, lon2, distancia_km, criado_em, observacoes
-            FROM consultas
-            ORDER BY id DESC
-            LIMIT ? OFFSET ?
-            """,
-            (limit, offset)
-        ).fetchall()
-
-        dados = [dict(r) for r in rows]
-        return {"total": len(dados), "items": dados}, 200
+        # ETag muda a cada escrita em consultas: 304 sem ler a página
+        versao = db.execute(SQL_VERSAO).fetchone()[0]
+        etag = hashlib.sha1(f"{versao}-{request.full_path}".encode()).hexdigest()
+
+        def gerar():
+            if "offset" in request.args and "before_id" not in request.args:
+                # Caminho legado: OFFSET obriga o SQLite a percorrer e descartar 'offset' linhas
+                offset = max(0, int(request.args["offset"]))
+                sql, params, limite, headers = SQL_LIST_OFFSET, (limit, offset), None, {"Deprecation": "true"}
+            else:
+                # Keyset: busca direta na B-tree do id a partir de before_id
+                before_id = int(request.args.get("before_id", SQLITE_MAX_ID))
+                sql, params, limite, headers = SQL_LIST, (before_id, limit), limit, {}
+
+            # Executa antes de responder (erros ainda viram 500); cursor sem row_factory:
+            # tuplas simples, sem alocar um sqlite3.Row por linha
+            cur = db.cursor()
+            cur.row_factory = None
+            cur.execute(sql, params)
+            resp = app.response_class(gerar_json_consultas(cur, limite), mimetype="application/json")
+            # O corpo é gerado depois do teardown: a conexão sai do g e passa a ser
+            # devolvida ao pool quando a resposta é fechada (mesmo sem ler o corpo)
+            g.pop("db")
+
+            def liberar():
+                cur.close()
+                devolver_conexao(db)
+
+            resp.call_on_close(liberar)
+            return resp, 200, headers
+
+        # no-cache: a primeira página muda a cada nova consulta, então sempre revalida
+        return responder_com_etag(etag, "public, no-cache", gerar)
     except Exception as e:
         return {"erro": f"Erro inesperado: {str(e)}"}, 500
 
@@ -335,12 +880,12 @@ def obter_consulta(consulta_id: int):
         description: Não encontrada
     """
     db = get_db()
-    row = db.execute(
-        "SELECT * FROM consultas WHERE id = ?", (consulta_id,)
-    ).fetchone()
+    row = db.execute(SQL_GET, (consulta_id,)).fetchone()
     if not row:
         return {"erro": "Consulta não encontrada."}, 404
-    return dict(row), 200
+    # Só 'observacoes' muda após a criação
+    etag = hashlib.sha1(f"{row['id']}-{row['criado_em']}-{row['observacoes']}".encode()).hexdigest()
+    return responder_com_etag(etag, "public, max-age=60", lambda: (consulta_para_dict(row), 200))
 
 @app.route("/consultas/<int:consulta_id>", methods=["PUT"])
 def atualizar_consulta(consulta_id: int):
@@ -375,14 +920,12 @@ def atualizar_consulta(consulta_id: int):
     observacoes = body.get("observacoes")
 
     db = get_db()
-    cur = db.execute("UPDATE consultas SET observacoes = ? WHERE id = ?", (observacoes, consulta_id))
-    db.commit()
+    with transacao(db):
+        row = db.execute(SQL_UPDATE, (observacoes, consulta_id)).fetchone()
 
-    if cur.rowcount == 0:
+    if row is None:
         return {"erro": "Consulta não encontrada."}, 404
-
-    row = db.execute("SELECT * FROM consultas WHERE id = ?", (consulta_id,)).fetchone()
-    return dict(row), 200
+    return consulta_para_dict(row), 200
 
 @app.route("/consultas/<int:consulta_id>", methods=["DELETE"])
 def excluir_consulta(consulta_id: int):
@@ -403,9 +946,9 @@ def excluir_consulta(consulta_id: int):
         description: Não encontrada
     """
     db = get_db()
-    cur = db.execute("DELETE FROM consultas WHERE id = ?", (consulta_id,))
-    db.commit()
-    if cur.rowcount == 0:
+    with transacao(db):
+        row = db.execute(SQL_DELETE, (consulta_id,)).fetchone()
+    if row is None:
         return {"erro": "Consulta não encontrada."}, 404
     return {"status": "excluída", "id": consulta_id}, 200
 
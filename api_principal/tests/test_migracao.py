@@ -0,0 +1,79 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+# O app abre o banco no import: aponta DB_PATH para um diretório temporário antes
+_TMP = tempfile.TemporaryDirectory()
+os.environ["DB_PATH"] = os.path.join(_TMP.name, "app.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+class MigracaoCriadoEmTest(unittest.TestCase):
+    """migrar_criado_em() em um banco no formato antigo (criado_em TEXT)."""
+
+    def setUp(self):
+        self.conn = sqlite3.connect(os.path.join(_TMP.name, f"{self.id()}.db"))
+        self.conn.execute(
+            """
+            CREATE TABLE consultas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cep_origem TEXT NOT NULL,
+                cep_destino TEXT NOT NULL,
+                lat1 REAL NOT NULL,
+                lon1 REAL NOT NULL,
+                lat2 REAL NOT NULL,
+                lon2 REAL NOT NULL,
+                distancia_km REAL NOT NULL,
+                criado_em TEXT NOT NULL,
+                observacoes TEXT
+            );
+            """
+        )
+        self.conn.executemany(
+            "INSERT INTO consultas (cep_origem, cep_destino, lat1, lon1, lat2, lon2, distancia_km, criado_em)"
+            " VALUES ('01001000', '20040020', -23.5, -46.6, -22.9, -43.2, 357.0, ?)",
+            [(f"2025-01-0{d}T12:00:00Z",) for d in range(1, 6)],
+        )
+        # A última consulta foi excluída: o id 5 não pode ser reutilizado
+        self.conn.execute("DELETE FROM consultas WHERE id = 5")
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_converte_criado_em_para_inteiro(self):
+        app.migrar_criado_em(self.conn)
+        tipo = next(col[2] for col in self.conn.execute("PRAGMA table_info(consultas)") if col[1] == "criado_em")
+        self.assertEqual(tipo, "INTEGER")
+        criado_em = self.conn.execute("SELECT criado_em FROM consultas WHERE id = 1").fetchone()[0]
+        self.assertIsInstance(criado_em, int)
+        self.assertEqual(app.formatar_criado_em(criado_em), "2025-01-01T12:00:00Z")
+
+    def test_segunda_migracao_nao_faz_nada(self):
+        # Outro worker que chega depois encontra a coluna já convertida
+        app.migrar_criado_em(self.conn)
+        antes = self.conn.execute("SELECT id, criado_em FROM consultas ORDER BY id").fetchall()
+        app.migrar_criado_em(self.conn)
+        self.assertFalse(self.conn.in_transaction)
+        self.assertEqual(self.conn.execute("SELECT id, criado_em FROM consultas ORDER BY id").fetchall(), antes)
+
+    def test_preserva_sequencia_do_autoincrement(self):
+        app.migrar_criado_em(self.conn)
+        seq = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'consultas'").fetchone()[0]
+        self.assertEqual(seq, 5)
+        self.assertIsNone(
+            self.conn.execute("SELECT 1 FROM sqlite_sequence WHERE name = 'consultas_nova'").fetchone()
+        )
+        cur = self.conn.execute(
+            "INSERT INTO consultas (cep_origem, cep_destino, lat1, lon1, lat2, lon2, distancia_km, criado_em)"
+            " VALUES ('01001000', '20040020', 0, 0, 0, 0, 0, 0)"
+        )
+        self.assertEqual(cur.lastrowid, 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
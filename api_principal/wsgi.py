@@ -0,0 +1,8 @@
+# Ponto de entrada WSGI para o gunicorn (workers gevent).
+# O monkey patch precisa acontecer antes de qualquer import de rede/threads.
+from gevent import monkey
+monkey.patch_all()
+
+from app import app  # noqa: E402
+
+# Execução: gunicorn -k gevent -w 2 --worker-connections 200 -b 0.0.0.0:5000 wsgi:app
@@ -1,8 +1,31 @@
-from flask import Flask, jsonify, request
+import os
+
+from flask import Flask, jsonify, request, send_file
+from flask.json.provider import JSONProvider
 from flasgger import Swagger
-from math import radians, sin, cos, asin, sqrt
+import numpy as np
+import orjson
+
+from distancia import haversine_km, haversine_km_lote
+
+class OrjsonProvider(JSONProvider):
+    """Provider JSON do Flask baseado em orjson (serialização mais rápida que o json da stdlib)."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Serializa direto para bytes, sem passar por str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), mimetype="application/json"
+        )
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # Configuração mínima do Swagger
 swagger_template = {
@@ -16,6 +39,12 @@ swagger_template = {
 }
 Swagger(app, template=swagger_template)
 
+# Spec OpenAPI pré-gerada no build (gerar_apispec.py): servida como arquivo estático,
+# sem o Flasgger percorrer as rotas a cada /apispec_1.json. Sem o arquivo (dev), o Flasgger gera.
+APISPEC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "apispec.json")
+if os.path.exists(APISPEC_PATH):
+    app.view_functions["flasgger.apispec_1"] = lambda: send_file(APISPEC_PATH, mimetype="application/json")
+
 @app.route("/health", methods=["GET"])
 def health():
     """
@@ -35,16 +64,6 @@ def health():
     """
     return jsonify({"status": "ok"}), 200
 
-def haversine_km(lat1, lon1, lat2, lon2):
-    """Calcula distância em km entre dois pontos (lat/lon) pela fórmula de Haversine."""
-    R = 6371.0  # Raio médio da Terra em km
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = sin(dlat/2)**2 + cos(lat1)*cos(lat2)*sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    return R * c
-
 @app.route("/calcular-distancia", methods=["POST"])
 def calcular_distancia():
     """
@@ -127,5 +146,104 @@ def calcular_distancia():
     except Exception as e:
         return {"erro": f"Erro inesperado: {str(e)}"}, 500
 
+@app.route("/calcular-distancia/bulk", methods=["POST"])
+def calcular_distancia_bulk():
+    """
+    Calcular distâncias para vários pares de coordenadas (Haversine vetorizado)
+    ---
+    tags:
+      - Distância
+    consumes:
+      - application/json
+    parameters:
+      - in: body
+        name: payload
+        required: true
+        schema:
+          type: object
+          required:
+            - items
+          properties:
+            items:
+              type: array
+              items:
+                type: object
+                required: [origem, destino]
+                properties:
+                  origem:
+                    type: object
+                    required: [lat, lon]
+                    properties:
+                      lat:
+                        type: number
+                        example: -22.9068
+                      lon:
+                        type: number
+                        example: -43.1729
+                  destino:
+                    type: object
+                    required: [lat, lon]
+                    properties:
+                      lat:
+                        type: number
+                        example: -23.5505
+                      lon:
+                        type: number
+                        example: -46.6333
+    responses:
+      200:
+        description: Distâncias calculadas com sucesso (mesma ordem de 'items')
+        schema:
+          type: object
+          properties:
+            total:
+              type: integer
+              example: 1
+            distancias_km:
+              type: array
+              items:
+                type: number
+              example: [357.8]
+      400:
+        description: Erro de validação ou payload inválido
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        itens = data.get("items")
+        if not isinstance(itens, list) or not itens:
+            return {"erro": "Informe 'items' como uma lista não vazia de pares origem/destino."}, 400
+
+        lat1, lon1, lat2, lon2 = [], [], [], []
+        for i, item in enumerate(itens):
+            origem = item.get("origem") if isinstance(item, dict) else None
+            destino = item.get("destino") if isinstance(item, dict) else None
+            for campo, bloco in (("origem", origem), ("destino", destino)):
+                if not isinstance(bloco, dict) or "lat" not in bloco or "lon" not in bloco:
+                    return {"erro": f"items[{i}]: '{campo}' deve conter 'lat' e 'lon'"}, 400
+                # bool é subclasse de int: true/false viraria 1.0/0.0 no np.asarray
+                if isinstance(bloco["lat"], bool) or isinstance(bloco["lon"], bool):
+                    return {"erro": f"items[{i}]: '{campo}' deve ter 'lat' e 'lon' numéricos"}, 400
+            lat1.append(origem["lat"])
+            lon1.append(origem["lon"])
+            lat2.append(destino["lat"])
+            lon2.append(destino["lon"])
+
+        coords = [np.asarray(v, dtype=np.float64) for v in (lat1, lon1, lat2, lon2)]
+        # NaN/inf (ex.: "nan" como string) passariam pelo asarray e sairiam como NaN
+        # Valores aninhados (ex.: {"lat": [1, 2]}) gerariam arrays 2-D, que o kernel não aceita
+        if any(c.ndim != 1 or c.shape[0] != len(itens) for c in coords):
+            return {"erro": "Valores de latitude/longitude inválidos."}, 400
+        if not all(np.isfinite(c).all() for c in coords):
+            return {"erro": "Valores de latitude/longitude inválidos."}, 400
+        distancias = haversine_km_lote(*coords)
+        return {
+            "total": len(itens),
+            "distancias_km": distancias.round(3).tolist()
+        }, 200
+    except (ValueError, TypeError):
+        return {"erro": "Valores de latitude/longitude inválidos."}, 400
+    except Exception as e:
+        return {"erro": f"Erro inesperado: {str(e)}"}, 500
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5001, debug=True)
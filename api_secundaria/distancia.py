@@ -0,0 +1,37 @@
+# Fórmula de Haversine compilada com Numba.
+# Módulo separado do app Flask para que a API Principal possa importá-lo
+# (como `distancia`) sem carregar a API Secundária inteira, e para que o cache
+# em disco do Numba seja o mesmo nos dois processos (ele é ligado ao nome do módulo).
+from math import radians, sin, cos, asin, sqrt
+
+import numpy as np
+from numba import njit
+
+@njit(cache=True, fastmath=True)
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Calcula distância em km entre dois pontos (lat/lon) pela fórmula de Haversine (compilada com Numba)."""
+    R = 6371.0  # Raio médio da Terra em km
+    lat1 = radians(lat1)
+    lon1 = radians(lon1)
+    lat2 = radians(lat2)
+    lon2 = radians(lon2)
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = sin(dlat/2)**2 + cos(lat1)*cos(lat2)*sin(dlon/2)**2
+    c = 2 * asin(sqrt(a))
+    return R * c
+
+# Sem parallel=True: o servidor é multi-thread e a camada 'workqueue' do Numba
+# (usada sem TBB/OpenMP na imagem) aborta o processo em chamadas concorrentes
+@njit(cache=True, fastmath=True)
+def haversine_km_lote(lat1, lon1, lat2, lon2):
+    """Versão em lote de haversine_km: recebe arrays e retorna array de distâncias em km."""
+    n = lat1.shape[0]
+    distancias = np.empty(n, dtype=np.float64)
+    for i in range(n):
+        distancias[i] = haversine_km(lat1[i], lon1[i], lat2[i], lon2[i])
+    return distancias
+
+# Compila (ou carrega do cache em disco) no import, para o 1º request não pagar a compilação
+haversine_km(0.0, 0.0, 0.0, 0.0)
+haversine_km_lote(np.zeros(1), np.zeros(1), np.zeros(1), np.zeros(1))
@@ -0,0 +1,16 @@
+# Gera static/apispec.json a partir das docstrings das rotas (Flasgger).
+# Executado no build da imagem; com o arquivo presente, o app serve a spec pronta
+# em /apispec_1.json em vez de gerá-la em tempo de execução.
+import os
+
+import orjson
+
+from app import app, APISPEC_PATH
+
+if __name__ == "__main__":
+    with app.test_request_context():
+        spec = app.swag.get_apispecs()
+    os.makedirs(os.path.dirname(APISPEC_PATH), exist_ok=True)
+    with open(APISPEC_PATH, "wb") as f:
+        f.write(orjson.dumps(spec, option=orjson.OPT_NON_STR_KEYS))
+    print(f"Spec gerada em {APISPEC_PATH}")
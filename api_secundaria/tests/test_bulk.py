@@ -0,0 +1,50 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+ORIGEM = {"lat": -22.9068, "lon": -43.1729}
+DESTINO = {"lat": -23.5505, "lon": -46.6333}
+
+
+class CalcularDistanciaBulkTest(unittest.TestCase):
+    """Validação do payload de /calcular-distancia/bulk."""
+
+    def setUp(self):
+        self.client = app.app.test_client()
+
+    def post(self, *itens):
+        return self.client.post("/calcular-distancia/bulk", json={"items": list(itens)})
+
+    def assertInvalido(self, origem):
+        r = self.post({"origem": ORIGEM, "destino": DESTINO}, {"origem": origem, "destino": DESTINO})
+        self.assertEqual(r.status_code, 400, r.get_json())
+        self.assertIn("erro", r.get_json())
+
+    def test_calcula_lote(self):
+        r = self.post({"origem": ORIGEM, "destino": DESTINO}, {"origem": DESTINO, "destino": ORIGEM})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.get_json()["total"], 2)
+        self.assertEqual(len(r.get_json()["distancias_km"]), 2)
+
+    def test_rejeita_booleanos(self):
+        self.assertInvalido({"lat": True, "lon": -43.1729})
+
+    def test_rejeita_nao_finitos(self):
+        self.assertInvalido({"lat": "nan", "lon": -43.1729})
+        self.assertInvalido({"lat": -22.9068, "lon": "inf"})
+
+    def test_rejeita_valores_aninhados(self):
+        # Todos aninhados: np.asarray geraria um array 2-D sem erro
+        r = self.post({"origem": {"lat": [1, 2], "lon": [1, 2]}, "destino": {"lat": [1, 2], "lon": [1, 2]}})
+        self.assertEqual(r.status_code, 400, r.get_json())
+        r = self.post({"origem": {"lat": [[1]], "lon": [[1]]}, "destino": {"lat": [[1]], "lon": [[1]]}})
+        self.assertEqual(r.status_code, 400, r.get_json())
+        self.assertInvalido({"lat": [1, 2], "lon": -43.1729})
+
+
+if __name__ == "__main__":
+    unittest.main()